@@ -1,6 +1,17 @@
-import pandas as pd
 import numpy as np
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 import os
+import csv
+import duckdb
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+# Keep matplotlib's font cache next to the app so it is built once and reused
+# across runs, and pick the non-interactive Agg backend before pyplot loads
+os.environ.setdefault("MPLCONFIGDIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mplcache"))
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import geopandas as gpd
 
@@ -11,63 +22,136 @@ OUTPUT_FOLDER = "output"
 # Ensure output directory exists
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# World map used for the risk map, cached locally after the first download
+WORLD_MAP_URL = "https://naturalearth.s3.amazonaws.com/110m_cultural/ne_110m_admin_0_countries.zip"
+CACHE_FOLDER = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "momole")
+
 # Expected column mappings (now using Gene Set instead of SNP)
 COLUMN_MAPPINGS = {
     "Gene_Set": ["Gene Set", "Geneset", "Pathway", "Curated Set"],
     "Beta": ["Beta", "Effect_Size"],
 }
 
-def find_latest_file(directory, extensions):
-    """Find the latest file in a directory with the given extension."""
-    files = [f for f in os.listdir(directory) if f.endswith(tuple(extensions))]
-    if not files:
-        return None
-    files.sort(key=lambda x: os.path.getmtime(os.path.join(directory, x)), reverse=True)
-    return os.path.join(directory, files[0])
+# Reverse lookup from each accepted column name to its standard name, built once.
+# A column already named with the standard name is accepted first
+COLUMN_ALIASES = {
+    alias: standard_name
+    for standard_name, possible_names in COLUMN_MAPPINGS.items()
+    for alias in [standard_name, *possible_names]
+}
+
+# Strings read as missing values, copied from pandas' read_csv defaults
+# (pandas._libs.parsers.STR_NA_VALUES)
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+def list_latest_files(directory, extensions):
+    """List files in a directory with the given extensions, newest first."""
+    # DirEntry caches its stat result, so each file is stat'ed at most once
+    with os.scandir(directory) as entries:
+        files = [e for e in entries if e.name.endswith(tuple(extensions)) and e.is_file()]
+    files.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    return [e.path for e in files]
 
-def standardize_columns(df):
-    """Rename GWAS columns to match expected names."""
+def get_rename_map(columns):
+    """Map GWAS column names to the expected names."""
+    present = set(columns)
     rename_map = {}
-    for standard_name, possible_names in COLUMN_MAPPINGS.items():
-        for col in possible_names:
-            if col in df.columns:
-                rename_map[col] = standard_name
-                break
-    df.rename(columns=rename_map, inplace=True)
-    return df
+    claimed = set()
+    # Aliases are visited in priority order, so the first match for each name wins
+    for alias, standard_name in COLUMN_ALIASES.items():
+        if alias in present and standard_name not in claimed:
+            rename_map[alias] = standard_name
+            claimed.add(standard_name)
+    return rename_map
 
 def detect_separator(file_path):
     """Detect if file is CSV (comma-separated) or TSV (tab-separated)."""
-    with open(file_path, "r", encoding="utf-8") as f:
-        first_line = f.readline()
-        return "," if "," in first_line else "\t"
+    with open(file_path, "rb") as f:
+        first_line = f.read(4096).split(b"\n", 1)[0]
+    # Compare counts so a stray comma in a TSV header doesn't misclassify it
+    return "," if first_line.count(b",") > first_line.count(b"\t") else "\t"
+
+def read_header(file_path, separator):
+    """Read only the header row (column names) of a CSV/TSV file."""
+    with open(file_path, "r", encoding="utf-8-sig", newline="") as f:
+        return next(csv.reader(f, delimiter=separator), [])
 
-def calculate_gene_based_prs(gwas_path):
+def calculate_gene_based_prs(gwas_path, threads=None):
     """Computes PRS from gene-based GWAS summary data."""
     print(f"Loading GWAS file: {gwas_path}")
 
-    # Detect file format
+    # Detect file format and read just the header row, so a file with the wrong
+    # schema is rejected before any of its body is parsed
     separator = detect_separator(gwas_path)
-    gwas_df = pd.read_csv(gwas_path, sep=separator)
+    file_columns = read_header(gwas_path, separator)
 
     # Standardize column names
-    gwas_df = standardize_columns(gwas_df)
+    rename_map = get_rename_map(file_columns)
 
     # Check if required columns exist after renaming
     required_cols = {"Gene_Set", "Beta"}
-    if not required_cols.issubset(gwas_df.columns):
-        raise ValueError(f"Missing required columns in GWAS file after renaming: {required_cols - set(gwas_df.columns)}")
+    columns = set(rename_map.values())
+    if not required_cols.issubset(columns):
+        raise ValueError(f"Missing required columns in GWAS file after renaming: {required_cols - columns}")
 
-    # Compute PRS Score for each gene set (sum of beta values)
-    prs_score = gwas_df.groupby("Gene_Set")["Beta"].sum().reset_index()
-    prs_score.columns = ["Gene_Set", "PRS_Score"]
+    # Sum beta values per gene set in DuckDB, which scans the file in parallel and
+    # only keeps the running totals in memory. Missing and NaN betas are skipped
+    # (an all-missing gene set scores 0) and rows without a gene set are dropped,
+    # as pandas' groupby did
+    # Columns are addressed by position under synthetic names (c0, c1, ...), since
+    # DuckDB matches names case-insensitively and would dedupe "beta"/"Beta" itself
+    gene_set_col = next(col for col, name in rename_map.items() if name == "Gene_Set")
+    beta_col = next(col for col, name in rename_map.items() if name == "Beta")
+    column_names = [f"c{i}" for i in range(len(file_columns))]
+    gene_set_ref = column_names[file_columns.index(gene_set_col)]
+    beta_ref = column_names[file_columns.index(beta_col)]
+    query = f"""
+        SELECT Gene_Set, COALESCE(SUM(Beta) FILTER (WHERE NOT isnan(Beta)), 0) AS PRS_Score
+        FROM (
+            SELECT {gene_set_ref} AS Gene_Set, CAST({beta_ref} AS DOUBLE) AS Beta
+            FROM read_csv(?, delim = ?, header = true, names = ?, all_varchar = true, nullstr = ?)
+            WHERE {gene_set_ref} IS NOT NULL
+        )
+        GROUP BY 1
+        ORDER BY 1
+    """
+    config = {"threads": threads} if threads else {}
+    with duckdb.connect(config=config) as con:
+        # Arrow table so the Parquet/CSV writers take it without a pandas round-trip
+        # (relation.to_arrow_table() exists on every supported duckdb release)
+        prs_score = con.sql(query, params=[gwas_path, separator, column_names, NA_VALUES]).to_arrow_table()
 
     return prs_score
 
-def plot_prs_distribution(prs_results):
+def calculate_gene_based_prs_for_files(gwas_paths):
+    """Computes PRS for several GWAS files in parallel, one worker process per file."""
+    if len(gwas_paths) == 1:
+        # No point paying for a process pool with a single file
+        return {gwas_paths[0]: calculate_gene_based_prs(gwas_paths[0])}
+
+    # Split DuckDB's threads between the workers so they don't oversubscribe the cores
+    workers = min(len(gwas_paths), os.cpu_count() or 1)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {path: executor.submit(calculate_gene_based_prs, path, threads_per_worker) for path in gwas_paths}
+        for path, future in futures.items():
+            # One malformed file shouldn't discard the results of the others
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                print(f"❌ Error in {path}: {str(e)}")
+    return results
+
+def plot_prs_distribution(prs_results, prefix=""):
     """Generates a bar chart for PRS scores."""
-    plt.figure(figsize=(10, 5))
-    prs_results.plot(kind="bar", x="Gene_Set", y="PRS_Score", legend=False, color="skyblue")
+    # Draw with matplotlib directly; DataFrame.plot also opened a second, default-sized figure
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.bar(prs_results["Gene_Set"].to_numpy(), prs_results["PRS_Score"].to_numpy(), color="skyblue")
     plt.xlabel("Gene Set")
     plt.ylabel("PRS Score")
     plt.title("Polygenic Risk Score (PRS) Distribution by Gene Set")
@@ -75,14 +159,42 @@ def plot_prs_distribution(prs_results):
     plt.tight_layout()
 
     # Save the plot
-    plot_path = os.path.join(OUTPUT_FOLDER, "prs_distribution.png")
+    plot_path = os.path.join(OUTPUT_FOLDER, f"{prefix}prs_distribution.png")
     plt.savefig(plot_path)
     plt.close()
     print(f"📊 PRS distribution plot saved as {plot_path}")
 
-def generate_risk_map(prs_results):
+def load_world_map():
+    """Load the Natural Earth country map, downloading it only on a cache miss."""
+    zip_path = os.path.join(CACHE_FOLDER, "ne_110m_admin_0_countries.zip")
+    parquet_path = os.path.join(CACHE_FOLDER, "ne_110m_admin_0_countries.parquet")
+
+    # GeoParquet copy from a previous run loads much faster than the shapefile
+    if os.path.exists(parquet_path):
+        return gpd.read_parquet(parquet_path)
+
+    if not os.path.exists(zip_path):
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        # Download to a temporary name so an interrupted run leaves no partial zip
+        urllib.request.urlretrieve(WORLD_MAP_URL, zip_path + ".part")
+        os.replace(zip_path + ".part", zip_path)
+
+    world = gpd.read_file(zip_path)
+
+    # The GeoParquet copy is only a speed-up, so failing to write it isn't fatal;
+    # writing to a temporary name keeps a truncated file from poisoning later runs
+    try:
+        world.to_parquet(parquet_path + ".part")
+        os.replace(parquet_path + ".part", parquet_path)
+    except OSError as e:
+        print(f"⚠️ Could not cache world map as GeoParquet: {str(e)}")
+        if os.path.exists(parquet_path + ".part"):
+            os.remove(parquet_path + ".part")
+    return world
+
+def generate_risk_map(prs_results, prefix=""):
     """Generates a simulated geographic risk map for PRS scores."""
-    world = gpd.read_file("https://naturalearth.s3.amazonaws.com/110m_cultural/ne_110m_admin_0_countries.zip")
+    world = load_world_map()
 
     # Simulated PRS mapping to random countries
     country_mapping = {
@@ -90,48 +202,61 @@ def generate_risk_map(prs_results):
         "Other_gene_set": "Canada"
     }
 
-    # Create dataset with country-level PRS scores
-    risk_data = pd.DataFrame(list(country_mapping.items()), columns=["Gene_Set", "Country"])
-    risk_data = risk_data.merge(prs_results, on="Gene_Set", how="left")
-
-    # Merge with world map
-    world = world.merge(risk_data, left_on="ADMIN", right_on="Country", how="left")
+    # Look up country-level PRS scores (NaN for gene sets without a score)
+    gene_set_scores = dict(zip(prs_results["Gene_Set"], prs_results["PRS_Score"]))
+    country_to_score = {country: gene_set_scores.get(gene_set, np.nan) for gene_set, country in country_mapping.items()}
 
+    # Attach scores to the world map; countries not in the mapping are left as NaN
+    world["PRS_Score"] = world["ADMIN"].map(country_to_score)
 
     # Plot the risk map
     fig, ax = plt.subplots(figsize=(12, 6))
     world.plot(column="PRS_Score", cmap="Reds", linewidth=0.8, edgecolor="black", legend=True, ax=ax)
     plt.title("Global Distribution of Polygenic Risk Score")
-    plt.savefig(os.path.join(OUTPUT_FOLDER, "prs_risk_map.png"))
+    map_path = os.path.join(OUTPUT_FOLDER, f"{prefix}prs_risk_map.png")
+    plt.savefig(map_path)
     plt.close()
-    print(f"🗺️ PRS risk map saved as {OUTPUT_FOLDER}/prs_risk_map.png")
+    print(f"🗺️ PRS risk map saved as {map_path}")
 
 def main():
     """Main function to process PRS calculation for gene-based GWAS data and generate visualizations."""
-    gwas_file = find_latest_file(INPUT_FOLDER, [".tsv", ".csv"])
+    gwas_files = list_latest_files(INPUT_FOLDER, [".tsv", ".csv"])
 
-    if not gwas_file:
+    if not gwas_files:
         print("❌ Missing GWAS file in 'input/' folder.")
         return
 
     try:
-        prs_results = calculate_gene_based_prs(gwas_file)
+        all_results = calculate_gene_based_prs_for_files(gwas_files)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return
 
-        # Save PRS results
-        prs_csv_path = os.path.join(OUTPUT_FOLDER, "gene_prs_results.csv")
-        prs_json_path = os.path.join(OUTPUT_FOLDER, "gene_prs_results.json")
+    for gwas_file, prs_results in all_results.items():
+        # Keep the plain output names for a single file; prefix them when there are several.
+        # The prefix keeps the extension so x.csv and x.tsv don't overwrite each other
+        prefix = ""
+        if len(gwas_files) > 1:
+            prefix = os.path.basename(gwas_file).replace(".", "_") + "_"
 
-        prs_results.to_csv(prs_csv_path, index=False)
-        prs_results.to_json(prs_json_path, orient="records")
+        # A failure while saving or plotting one file shouldn't skip the files after it
+        try:
+            # Save PRS results as Parquet, plus a CSV for a human-readable copy
+            prs_parquet_path = os.path.join(OUTPUT_FOLDER, f"{prefix}gene_prs_results.parquet")
+            prs_csv_path = os.path.join(OUTPUT_FOLDER, f"{prefix}gene_prs_results.csv")
 
-        print(f"✅ Gene-based PRS calculation complete! Results saved in:\n📁 {prs_csv_path}\n📁 {prs_json_path}")
+            pq.write_table(prs_results, prs_parquet_path, compression="snappy")
+            pv.write_csv(prs_results, prs_csv_path)
 
-        # Generate visual outputs
-        plot_prs_distribution(prs_results)
-        generate_risk_map(prs_results)
+            print(f"✅ Gene-based PRS calculation complete! Results saved in:\n📁 {prs_parquet_path}\n📁 {prs_csv_path}")
 
-    except Exception as e:
-        print(f"❌ Error: {str(e)}")
+            # Generate visual outputs (plotting works on pandas)
+            prs_df = prs_results.to_pandas()
+            plot_prs_distribution(prs_df, prefix)
+            generate_risk_map(prs_df, prefix)
+
+        except Exception as e:
+            print(f"❌ Error in {gwas_file}: {str(e)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,4 +1,102 @@
-from app.main import multiply_by_two
+import pytest
 
-def test_mut_two():
-    assert multiply_by_two("2") == 4
+from app import main as app_main
+from app.main import calculate_gene_based_prs, calculate_gene_based_prs_for_files, detect_separator
+
+def write_gwas(tmp_path, text, name="gwas.csv"):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+def test_standard_header(tmp_path):
+    path = write_gwas(tmp_path, "Gene_Set,Beta\nb,0.5\na,1.0\na,0.25\n")
+    assert calculate_gene_based_prs(path).to_pydict() == {"Gene_Set": ["a", "b"], "PRS_Score": [1.25, 0.5]}
+
+def test_alias_header(tmp_path):
+    path = write_gwas(tmp_path, '"Gene Set","N genes","Beta"\n"a","10","1.15"\n"a","3","0.5"\n')
+    assert calculate_gene_based_prs(path).to_pydict() == {"Gene_Set": ["a"], "PRS_Score": [1.65]}
+
+def test_alias_priority(tmp_path):
+    # Both Beta and Effect_Size are present; Beta is listed first so it wins
+    path = write_gwas(tmp_path, "Pathway,Effect_Size,Beta\na,100,1\na,100,2\n")
+    assert calculate_gene_based_prs(path).to_pydict() == {"Gene_Set": ["a"], "PRS_Score": [3.0]}
+
+@pytest.mark.parametrize("header, row", [
+    ("Gene Set\tbeta\tBeta", "x\t100\t1"),
+    ("gene set\tGene Set\tBeta", "y\tx\t1"),
+])
+def test_columns_matched_case_sensitively(tmp_path, header, row):
+    # Only "Gene Set" and "Beta" match; the column differing only by case must not be read
+    path = write_gwas(tmp_path, f"{header}\n{row}\n", name="gwas.tsv")
+    assert calculate_gene_based_prs(path).to_pydict() == {"Gene_Set": ["x"], "PRS_Score": [1.0]}
+
+@pytest.mark.parametrize("missing", ["", "NA", "nan", "#N/A", "n/a", "None", "<NA>", "1.#QNAN", "-nan", "-NaN"])
+def test_missing_betas_are_skipped(tmp_path, missing):
+    path = write_gwas(tmp_path, f"Gene_Set,Beta\na,1.5\na,{missing}\nb,{missing}\n")
+    assert calculate_gene_based_prs(path).to_pydict() == {"Gene_Set": ["a", "b"], "PRS_Score": [1.5, 0.0]}
+
+def test_null_gene_sets_are_dropped(tmp_path):
+    path = write_gwas(tmp_path, "Gene_Set,Beta\na,1\nNA,2\n,3\n")
+    assert calculate_gene_based_prs(path).to_pydict() == {"Gene_Set": ["a"], "PRS_Score": [1.0]}
+
+def test_tsv_with_comma_in_header(tmp_path):
+    path = write_gwas(tmp_path, "Gene Set\tBeta\tNote, v2\na\t1\tx, y\na\t2\tz\n", name="gwas.tsv")
+    assert detect_separator(path) == "\t"
+    assert calculate_gene_based_prs(path).to_pydict() == {"Gene_Set": ["a"], "PRS_Score": [3.0]}
+
+def test_empty_body(tmp_path):
+    path = write_gwas(tmp_path, "Gene_Set,Beta\n")
+    prs = calculate_gene_based_prs(path)
+    assert prs.column_names == ["Gene_Set", "PRS_Score"]
+    assert prs.num_rows == 0
+
+def test_missing_columns_rejected_from_header(tmp_path):
+    # The body is not valid for the schema; the header check must fail first
+    path = write_gwas(tmp_path, "Gene Set,P\na,not-a-number,extra\n")
+    with pytest.raises(ValueError, match="Beta"):
+        calculate_gene_based_prs(path)
+
+def test_multiple_files_keyed_by_path(tmp_path):
+    first = write_gwas(tmp_path, "Gene_Set,Beta\na,1\na,2\n", name="first.csv")
+    second = write_gwas(tmp_path, "Gene Set\tBeta\nb,x\t4\n", name="second.tsv")
+    results = calculate_gene_based_prs_for_files([first, second])
+    assert {path: prs.to_pydict() for path, prs in results.items()} == {
+        first: {"Gene_Set": ["a"], "PRS_Score": [3.0]},
+        second: {"Gene_Set": ["b,x"], "PRS_Score": [4.0]},
+    }
+
+def test_bad_file_reported_and_others_returned(tmp_path, capsys):
+    good = write_gwas(tmp_path, "Gene_Set,Beta\na,1\n", name="good.csv")
+    bad = write_gwas(tmp_path, "Foo,Bar\n1,2\n", name="bad.csv")
+    results = calculate_gene_based_prs_for_files([good, bad])
+    assert list(results) == [good]
+    assert f"Error in {bad}" in capsys.readouterr().out
+
+def run_main(tmp_path, monkeypatch, files):
+    input_folder = tmp_path / "input"
+    output_folder = tmp_path / "output"
+    input_folder.mkdir()
+    output_folder.mkdir()
+    for name, text in files.items():
+        write_gwas(input_folder, text, name=name)
+    monkeypatch.setattr(app_main, "INPUT_FOLDER", str(input_folder))
+    monkeypatch.setattr(app_main, "OUTPUT_FOLDER", str(output_folder))
+    # The risk map needs the Natural Earth download; it is not under test here
+    monkeypatch.setattr(app_main, "generate_risk_map", lambda prs_results, prefix="": None)
+    app_main.main()
+    return sorted(p.name for p in output_folder.iterdir())
+
+def test_single_file_keeps_plain_output_names(tmp_path, monkeypatch):
+    outputs = run_main(tmp_path, monkeypatch, {"x.csv": "Gene_Set,Beta\na,1\n"})
+    assert outputs == ["gene_prs_results.csv", "gene_prs_results.parquet", "prs_distribution.png"]
+
+def test_several_files_get_distinct_prefixes(tmp_path, monkeypatch):
+    outputs = run_main(tmp_path, monkeypatch, {
+        "x.csv": "Gene_Set,Beta\na,1\n",
+        "x.tsv": "Gene_Set\tBeta\na\t2\n",
+    })
+    assert outputs == [
+        f"x_{ext}_{name}"
+        for ext in ["csv", "tsv"]
+        for name in ["gene_prs_results.csv", "gene_prs_results.parquet", "prs_distribution.png"]
+    ]